@@ -1,4 +1,6 @@
 # Cached utils for the dashboard
+import io
+
 import pandas as pd
 import plotly.express as px
 import streamlit as st
@@ -129,6 +131,62 @@ def get_rel_df_agg(rel_df, agg_level, esg_x):
     return rel_df
 
 
+# Serialize a dataframe as CSV one row chunk at a time
+def iter_csv_chunks(df, columns=None, chunk_size=50_000):
+    """
+    Yield the dataframe as encoded CSV in row chunks
+
+    >>> df = pd.DataFrame({"a,b": [1, 2, 3], "c": ["x", "y", "z"]})
+    >>> csv = b"".join(iter_csv_chunks(df, chunk_size=2))
+    >>> csv == df.to_csv(index=False).encode()
+    True
+    >>> b"".join(iter_csv_chunks(df.iloc[:0], ["c"]))
+    b'c\\n'
+    >>> next(iter_csv_chunks(df, chunk_size=0))
+    Traceback (most recent call last):
+    ...
+    ValueError: Chunk size must be positive
+
+    :param pd.DataFrame df: Dataframe to export
+    :param list columns: Columns to export. Default all columns.
+    :param int chunk_size: Rows serialized per chunk. Default 50,000.
+    :return: Generator of UTF-8 encoded CSV chunks, header in the first chunk
+    :rtype: Iterator[bytes]
+    :raises ValueError: If chunk_size is not positive
+    """
+    if chunk_size <= 0:
+        raise ValueError("Chunk size must be positive")
+    if columns is None:
+        columns = list(df.columns)
+
+    # Only one chunk of rows is ever serialized at a time, header on the first
+    yield df.iloc[:0][columns].to_csv(index=False).encode()
+    for start in range(0, len(df), chunk_size):
+        chunk = df.iloc[start : start + chunk_size][columns]
+        yield chunk.to_csv(index=False, header=False).encode()
+
+
+# Show a one-shot CSV download, only building the file once the user asks
+def show_csv_download(label, df, file_name, columns=None):
+    # Not cached, so widget changes never hash or serialize the data
+    if not st.button(f"Prepare {label}", key=f"prepare_{file_name}"):
+        return
+
+    # Write the chunks into a single buffer rather than joining a list
+    buffer = io.BytesIO()
+    for chunk in iter_csv_chunks(df, columns):
+        buffer.write(chunk)
+    buffer.seek(0)
+
+    st.download_button(
+        f"Download {label}",
+        buffer,
+        file_name=file_name,
+        mime="text/csv",
+        key=f"download_{file_name}",
+    )
+
+
 @st.cache_data
 def get_corr_fig(final_df):
     corr_df = final_df[esg_cols].corr()
@@ -301,10 +359,10 @@ def show_relationship_tab(final_df):
         end_date = pd.Timestamp(st.date_input("End Date", value=final_df["Date"].max()))
 
         # Get the filtered, market-cap scores, computing only on date change
-        rel_df = get_rel_df(final_df, start_date, end_date)
+        filtered_df = get_rel_df(final_df, start_date, end_date)
 
         # Aggregate by agg_level selector and average monthly return by market cap
-        rel_df = get_rel_df_agg(rel_df, agg_level, esg_x)
+        rel_df = get_rel_df_agg(filtered_df, agg_level, esg_x)
 
     with display_col:
         st.subheader(f"Average Monthly Return vs. {esg_x} by {agg_level}")
@@ -386,6 +444,23 @@ def show_relationship_tab(final_df):
         # Show summary stats
         st.write(rel_df.describe())
 
+        # Export the aggregated data and the date-filtered raw rows
+        st.subheader("Export")
+        show_csv_download(
+            "Aggregated Data",
+            rel_df,
+            f"relationship_{agg_level}_{esg_x}.csv".replace(" ", "_"),
+        )
+
+        # get_rel_df adds Cap columns and get_rel_df_agg adds Average columns
+        # to filtered_df on a cache miss, so export only the original columns
+        show_csv_download(
+            "Filtered Rows",
+            filtered_df,
+            f"filtered_{start_date:%Y-%m-%d}_{end_date:%Y-%m-%d}.csv",
+            columns=list(final_df.columns),
+        )
+
 
 def show_predictive_tab(final_df):
     st.header("Predictive Model")
@@ -530,6 +605,14 @@ def show_predictive_tab(final_df):
         # Show summary stats
         st.write(pred_df.describe())
 
+        # Export the aggregated predicted and actual returns
+        st.subheader("Export")
+        show_csv_download(
+            "Predictive Data",
+            pred_df,
+            f"predictive_{selected_industry}.csv".replace(" ", "_"),
+        )
+
 
 # TODO
 print("Imported utils.py")